@@ -35,7 +35,7 @@ Feeds of various flavours are generated by calling one of the following methods:
 >>> atom_feed
 '<?xml version="1.0" encoding="utf-8"?>...and so on...'
 
-Feeds are fetched in parallel (using threads).
+Feeds are fetched and parsed in parallel (using threads).
 
 If any of the `feeds` URLs cannot be fetched or parsed, the errors will be
 reported in the `error_urls` attribute.
@@ -53,15 +53,25 @@ import datetime
 import logging
 import functools
 import concurrent.futures
+import heapq
+import collections
+from operator import itemgetter
 from concurrent.futures import ThreadPoolExecutor
 import json
-from typing import Type, List, Optional, Callable, Dict, Union
+from urllib.parse import urlparse
+from typing import Type, List, Optional, Callable, Dict, Union, Tuple, Deque
 
 # https://docs.djangoproject.com/en/1.10/_modules/django/utils/feedgenerator/
 import feedgenerator
 from feedgenerator import Rss201rev2Feed, Atom1Feed, SyndicationFeed
 from jsonfeed import JSONFeed
 
+try:
+    # optional: much faster JSON serialization
+    import orjson
+except ImportError:
+    orjson = None
+
 import feedparser
 from feedparser.util import FeedParserDict
 
@@ -72,8 +82,15 @@ from requests.exceptions import RequestException
 # Memoize results from parser
 # TODO: make maxsize user-configurable
 @functools.lru_cache(maxsize=128)
-def cache_parser(text):
-    return feedparser.parse(text)
+def cache_parser(text, sanitize=True, content_type=None):
+    # Sanitizing HTML and resolving relative URIs are the most expensive
+    # steps of parsing, so they can be skipped for trusted feeds.
+    # The Content-Type header is passed along because it may carry the only
+    # declaration of the document's charset.
+    headers = {'content-type': content_type} if content_type else None
+    return feedparser.parse(text, sanitize_html=sanitize,
+                            resolve_relative_uris=sanitize,
+                            response_headers=headers)
 
 # Types:
 class ParseError(Exception): pass
@@ -82,14 +99,80 @@ error_dict_t = Dict[str, FCException]
 
 logger = logging.getLogger(__name__)
 
+def _entry_date(entry: dict) -> str:
+    """
+    Sort key for parsed entries: the published date (with fall back to the
+    updated date).
+    """
+    return entry.get('published') or entry.get('updated') or ""
+
+# Memoize the metadata extracted from each feed document, so that a feed which
+# has not changed since it was last fetched is neither re-parsed nor
+# re-extracted.
+# NOTE: the cached metadata dicts are shared between FeedMixer instances, so
+# they are copied before being handed out as `mixed_entries`.
+@functools.lru_cache(maxsize=128)
+def cache_entries(text: bytes, num_keep: int, prefer_summary: bool,
+                  sanitize: bool=True, content_type: Optional[str]=None
+                  ) -> Tuple[Tuple[str, dict], ...]:
+    """
+    Parse a feed and extract `feedgenerator`-compatible metadata from its
+    first `num_keep` entries (feeds normally list their newest entries first).
+
+    Returns:
+        A tuple of (sort key, metadata) pairs in the order the entries appear
+        in the feed.
+
+    Raises:
+        ParseError: if the feed could not be parsed.
+    """
+    f = cache_parser(text, sanitize, content_type)
+    logger.debug(cache_parser.cache_info())
+
+    parse_err = len(f.get('entries')) == 0 and f.get('bozo')
+    if f is None or parse_err:
+        logger.info("Parse error ({})".format(f.get('bozo_exception')))
+        raise ParseError("Parse error: {}".format(f.get('bozo_exception')))
+
+    # (avoid copying the list when keeping all of its entries anyway)
+    if num_keep < 1 or len(f.entries) <= num_keep:
+        newest = f.entries
+    else:
+        newest = f.entries[0:num_keep]
+
+    for e in newest:
+        e['feed_link'] = f.feed.link
+        e['feed_title'] = f.feed.title
+
+    # use feed author if individual entries are missing author property
+    metadata = FeedMixer.extract_meta(newest, prefer_summary,
+                                      f.feed.get('author_detail'))
+    return tuple(zip(map(_entry_date, newest), metadata))
+
+class FastJSONFeed(JSONFeed):
+    """
+    A `JSONFeed` which serializes with orjson_ when it is installed (falling
+    back to the standard library `json` module otherwise).
+
+    .. _orjson: https://github.com/ijl/orjson
+    """
+    def write(self, outfile, encoding):
+        if orjson is None:
+            return super().write(outfile, encoding)
+        data = self.add_root_elements()
+        data['items'] = [self.add_item_elements(item) for item in self.items]
+        outfile.write(orjson.dumps(data, default=self.json_serial)
+                      .decode('utf-8'))
+
 class FeedMixer(object):
     def __init__(self, title='Title', link='', desc='',
-                 feeds: List[Optional[str]]=[], num_keep=3, prefer_summary=True,
-                 max_threads=10, max_feeds=100, sess: requests.Session=None) -> None: 
+                 feeds: Optional[List[str]]=None, num_keep=3, prefer_summary=True,
+                 max_threads=10, max_feeds=100, sess: requests.Session=None,
+                 sanitize=True, max_per_host=2) -> None:
         """
-        __init__(self, title, link='', desc='', feeds=[], num_keep=3, \
+        __init__(self, title, link='', desc='', feeds=None, num_keep=3, \
             max_thread=5, max_feeds=100,
-            sess=requests.Session())
+            sess=requests.Session(), sanitize=True, max_per_host=2)
 
         Args:
             title: the title of the generated feed
@@ -100,24 +183,40 @@ class FeedMixer(object):
             prefer_summary: If True, prefer the (short) 'summary'; otherwise
                 prefer the (long) feed 'content'.
             max_threads: the maximum number of threads to spin up while fetching
-            feeds
+                feeds. The threads are started by the first fetch and re-used
+                by later ones (e.g. after `feeds` or `num_keep` change) until
+                `close()` is called. They are not shared with other instances,
+                so one instance's slow feeds never delay another's, at the cost
+                of each instance starting its own threads.
             max_feeds: the maximum number of feeds to fetch
                 injectable for testing purposes)
             sess: the requests.session object to use for making http GET
                 requests. You can pass in a session object that caches results (see
                 the cachecontrol package) or sets custom headers, etc. If not
                 set, a new default session will be used per request.
+            sanitize: If False, skip feedparser's HTML sanitizing and relative
+                URI resolution. This makes parsing considerably faster, but
+                should only be used when all of the `feeds` are trusted.
+            max_per_host: the maximum number of feeds to fetch concurrently
+                from any one host (so that many feeds from a single slow host
+                don't take up all of the threads)
         """
         self.title = title
         self.link = link
         self.desc = desc
         self.max_feeds = max_feeds
-        self._feeds = feeds[:max_feeds]
+        if feeds is None:
+            feeds = []
+        self.feeds = feeds
         self._num_keep = num_keep
         self.prefer_summary = prefer_summary
         self.max_threads = max_threads
+        self.sanitize = sanitize
+        self.max_per_host = max_per_host
         self._mixed_entries = []  # type: List[Optional[dict]]
+        self._per_feed_entries = []  # type: List[Tuple[Tuple[str, dict], ...]]
         self._error_urls = {}  # type: error_dict_t
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
         if sess is None:
             sess = requests.Session()
         self.sess = sess
@@ -129,15 +228,23 @@ class FeedMixer(object):
     @property
     def num_keep(self) -> int:
         """
-        The number of entries to keep from each feed in `feeds`. Setting this
-        property will trigger the feeds to be re-fetched.
+        The number of entries to keep from each feed in `feeds`. Increasing
+        this property will trigger the feeds to be re-fetched; decreasing it
+        just re-uses the entries already fetched from each feed.
         """
         return self._num_keep
 
     @num_keep.setter
     def num_keep(self, value: int) -> None:
+        old = self._num_keep
         self._num_keep = value
-        self.feeds = self._feeds
+        shrinking = value >= 1 and (old < 1 or value <= old)
+        if shrinking and self._per_feed_entries:
+            # the entries we already have (in feed order) are a superset of
+            # the ones we want
+            self.__mix([pairs[:value] for pairs in self._per_feed_entries])
+        else:
+            self.feeds = self._feeds
 
     @property
     def mixed_entries(self) -> List[Optional[dict]]:
@@ -167,12 +274,24 @@ class FeedMixer(object):
         return self._feeds
 
     @feeds.setter
-    def feeds(self, value: List[Optional[str]]) -> None:
+    def feeds(self, value: List[str]) -> None:
         """
         Reset _mixed_entries whenever we get a new list of feeds.
         """
-        self._feeds = value[:self.max_feeds]
+        if len(value) > self.max_feeds:
+            value = value[:self.max_feeds]
+        self._feeds = value
         self._mixed_entries = []
+        self._per_feed_entries = []
+
+    def close(self) -> None:
+        """
+        Shut down the threads used for fetching feeds. (New ones will be
+        started if the feeds need to be fetched again.)
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
     def atom_feed(self) -> str:
         """
@@ -196,81 +315,104 @@ class FeedMixer(object):
             A JSON dict consisting of the `num_keep` most recent entries from
             each of the `feeds`.
         """
-        return self.__generate_feed(JSONFeed).writeString('utf-8')
+        return self.__generate_feed(FastJSONFeed).writeString('utf-8')
 
     def __fetch_entries(self) -> None:
         """
-        Multi-threaded fetching of the `feeds`. Keeps the `num_keep` most recent
-        entries from each feed, combines them (sorted chronologically), extracts
-        `feedgernerator`-compatible metadata, and then stores the list of
-        entries as `self.mixed_entries`
+        Multi-threaded fetching and parsing of the `feeds`. Keeps the
+        `num_keep` most recent entries from each feed, combines them (sorted
+        chronologically), extracts `feedgernerator`-compatible metadata, and
+        then stores the list of entries as `self.mixed_entries`
         """
-        parsed_entries = []  # type: List[dict]
+        per_feed = []  # type: List[Tuple[Tuple[str, dict], ...]]
         self._error_urls = {}
 
-        def fetch(url):
+        # only fetch each URL once (even if it is listed more than once), and
+        # group the URLs by host so that requests to each host can be throttled
+        by_host = {}  # type: Dict[str, Deque[str]]
+        for url in dict.fromkeys(self.feeds):
+            by_host.setdefault(urlparse(url).netloc.lower(),
+                               collections.deque()).append(url)
+
+        def fetch_and_parse(url):
             r = self.sess.get(url)
             r.raise_for_status()
-            # NOTE: I tried doing the parsing here in the threads, but it was
-            # actually a bit slower than doing it all serially on the main
-            # thread.
-            return r
-
-        with ThreadPoolExecutor(max_workers=self.max_threads) as exec:
-            future_to_url = {exec.submit(fetch, url):
-                    url for url in self.feeds}
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
+            # Parse in the worker thread so that parsing one feed overlaps
+            # with the network I/O of the others (instead of parsing each
+            # response serially on the main thread as it completes).
+            # Hand feedparser the raw bytes (and the Content-Type header,
+            # which may declare the charset): it does its own encoding
+            # detection, so decoding into `r.text` first is wasted work.
+            entries = cache_entries(r.content, self._num_keep,
+                                    self.prefer_summary, self.sanitize,
+                                    r.headers.get('content-type'))
+
+            logger.debug(cache_entries.cache_info())
+            logger.info("Got feed from feedparser {}".format(url))
+            return entries
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads,
+                                                thread_name_prefix='feedmixer')
+        exec = self._executor
+        future_to_url = {}  # type: Dict[concurrent.futures.Future, Tuple[str, str]]
+
+        def submit_next(host):
+            url = by_host[host].popleft()
+            future = exec.submit(fetch_and_parse, url)
+            future_to_url[future] = (host, url)
+            return future
+
+        # Throttle each host by keeping at most `max_per_host` of its feeds in
+        # flight and submitting the next one as each finishes. (Doing this
+        # here rather than in the workers means no thread ever sits idle
+        # waiting on a slow host.)
+        not_done = set()
+        for host, urls in by_host.items():
+            for _ in range(min(len(urls), max(self.max_per_host, 1))):
+                not_done.add(submit_next(host))
+
+        while not_done:
+            done, not_done = concurrent.futures.wait(
+                not_done, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                host, url = future_to_url.pop(future)
+                if by_host[host]:
+                    not_done.add(submit_next(host))
                 logger.info("Fetched {}".format(url))
                 try:
-                    resp = future.result()
-                    f = cache_parser(resp.text)
-
-                    logger.debug(cache_parser.cache_info())
-                    logger.info("Got feed from feedparser {}".format(url))
-                    #logger.debug("Feed: {}".format(f))
-
-                    parse_err = len(f.get('entries')) == 0 and f.get('bozo')
-                    if f is None or parse_err:
-                        logger.info("Parse error ({})"
-                                    .format(f.get('bozo_exception')))
-                        raise ParseError("Parse error: {}"
-                                         .format(f.get('bozo_exception')))
-
-
-                    if self._num_keep < 1:
-                        newest = f.entries
-                    else:
-                        newest = f.entries[0:self._num_keep]
-
-                    for e in newest:
-                        e['feed_link'] = f.feed.link
-                        e['feed_title'] = f.feed.title
-                        if 'author_detail' not in e:
-                            # use feed author if individual entries are missing
-                            # author property
-                            if 'author_detail' in f.feed:
-                                e['author_detail'] = f.feed.author_detail
-                                e.author_detail = f.feed.author_detail
-
-                    parsed_entries += newest
+                    per_feed.append(future.result())
                 except Exception as e:
                     # will be ParseError, RequestException, or an exception
                     # from threadpool
                     self._error_urls[url] = e
                     logger.info("{} generated an exception: {}".format(url, e))
 
-        # sort entries by published date (with fall back to updated date)
-        parsed_entries.sort(key=lambda e: e.get('published') or e.get('updated') or "",
-                            reverse=True)
+        self.__mix(per_feed)
 
-        # extract metadata into a form usable by feedgenerator
-        mixed_entries = self.extract_meta(parsed_entries, self.prefer_summary)
-        self._mixed_entries = mixed_entries
+    def __mix(self, per_feed: List[Tuple[Tuple[str, dict], ...]]) -> None:
+        """
+        Merge the entries from each feed by published date (with fall back to
+        updated date) and store them as `self.mixed_entries`.
+        """
+        self._per_feed_entries = per_feed
+        # feeds are almost always already in reverse chronological order, so
+        # sorting each one is cheap; it guarantees the invariant heapq.merge()
+        # needs.
+        by_date = [sorted(pairs, key=itemgetter(0), reverse=True)
+                   for pairs in per_feed]
+        merged = heapq.merge(*by_date, key=itemgetter(0), reverse=True)
+        # copy the (cached, shared) metadata so that callers can modify their
+        # entries without affecting other instances
+        self._mixed_entries = [
+            {k: list(v) if isinstance(v, list) else v
+             for k, v in metadata.items()}
+            for _, metadata in merged]
 
     @staticmethod
-    def extract_meta(parsed_entries: List[dict],
-                     prefer_summary=True) -> List[Optional[dict]]:
+    def extract_meta(parsed_entries: List[dict], prefer_summary=True,
+                     default_author: Optional[dict]=None
+                     ) -> List[dict]:
         """
         Convert a FeedParserDict object into a dict compatible with the Django
         feedgenerator classes.
@@ -279,63 +421,77 @@ class FeedMixer(object):
             parsed_entries: List of entries from which to extract meta data.
             prefer_summary: If True, prefer the (short) 'summary'; otherwise
                 prefer the (long) 'content'.
+            default_author: The 'author_detail' to use for entries which don't
+                have their own.
         """
-        mixed_entries = [] # type: List[Optional[dict]]
+        # Most of the keys we read are stored directly in the underlying dict,
+        # so bypass FeedParserDict's key-mapping `get()` for those. Only the
+        # keys which feedparser synthesizes ('updated_parsed', 'license',
+        # 'enclosures') go through the mapped lookup.
+        _get = dict.get
+        Enclosure = feedgenerator.Enclosure
+        dt = datetime.datetime
+
+        def to_datetime(tp):
+            # convert time_struct tuples into datetime objects (clamping the
+            # seconds prevents error in the off-chance that the date contains
+            # a leap-second). Indexing directly avoids building intermediate
+            # tuples.
+            sec = tp[5]
+            return dt(tp[0], tp[1], tp[2], tp[3], tp[4],
+                      sec if sec < 60 else 59)
+
+        mixed_entries = [] # type: List[dict]
         for e in parsed_entries:
-            metadata = {}
-
-            # title, link, and description are mandatory
-            metadata['title'] = e.get('title', '')
-            metadata['link'] = e.get('link', '')
-
-            summary = e.get('summary')
-            content = e.get('content')
+            content = _get(e, 'content')
             if content:
                 # atom feeds can have several content tags, each with a
                 # different type. We just use the first one.
                 content = content[0].get('value')
+            summary = _get(e, 'summary')
             if prefer_summary:
                 content = summary or content
             else:
                 content = content or summary
-            metadata['description'] = content
-
-            if 'author_detail' in e:
-                metadata['author_email'] = e['author_detail'].get('email')
-                metadata['author_name'] = e['author_detail'].get('name')
-                metadata['author_link'] = e['author_detail'].get('href')
 
-            # Keep original feed info (this is only serialized in the JSON feed)
-            metadata['feed_link'] = e['feed_link']
-            metadata['feed_title'] = e['feed_title']
-
-            # convert time_struct tuples into datetime objects
-            # (the min() prevents error in the off-chance that the
-            # date contains a leap-second)
-            tp = e.get('published_parsed')
+            # title, link, and description are mandatory
+            metadata = {
+                'title': _get(e, 'title', ''),
+                'link': _get(e, 'link', ''),
+                'description': content,
+                # Keep original feed info (this is only serialized in the JSON
+                # feed)
+                'feed_link': e['feed_link'],
+                'feed_title': e['feed_title'],
+                'comments': _get(e, 'comments'),
+                'unique_id': _get(e, 'id'),
+                'item_copyright': e.get('license'),
+            }
+
+            author = _get(e, 'author_detail', default_author)
+            if author is not None:
+                metadata['author_email'] = author.get('email')
+                metadata['author_name'] = author.get('name')
+                metadata['author_link'] = author.get('href')
+
+            tp = _get(e, 'published_parsed')
             if tp:
-                metadata['pubdate'] = datetime.datetime(*tp[:5] + (min(tp[5],
-                                                                       59),))
+                metadata['pubdate'] = to_datetime(tp)
 
             tu = e.get('updated_parsed')
             if tu:
-                metadata['updateddate'] = datetime.datetime(*tu[:5] +
-                                                            (min(tu[5], 59),))
-
-            metadata['comments'] = e.get('comments')
-            metadata['unique_id'] = e.get('id')
-            metadata['item_copyright'] = e.get('license')
-
-            if 'tags' in e:
-                taglist = [tag.get('term') for tag in e['tags']]
-                metadata['categories'] = taglist
-            if 'enclosures' in e:
-                enclist = []
-                for enc in e['enclosures']:
-                    enclist.append(feedgenerator.Enclosure(enc.href, enc.length,
-                                                           enc.type))
+                metadata['updateddate'] = to_datetime(tu)
+
+            tags = _get(e, 'tags')
+            if tags is not None:
+                metadata['categories'] = [tag.get('term') for tag in tags]
+
+            encs = e.get('enclosures')
+            if encs is not None:
+                enclist = [Enclosure(enc.href, enc.length, enc.type)
+                           for enc in encs]
                 metadata['enclosures'] = enclist
-                if len(enclist) > 0:
+                if enclist:
                     # The current standalone version of feedgenerator does not
                     # handle 'enclosures' only a single 'enclosure'
                     metadata['enclosure'] = enclist[0]
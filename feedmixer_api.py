@@ -114,7 +114,10 @@ class MixedFeed:
         # dynamically find and call appropriate method based on ftype:
         method_name = "{}_feed".format(self.ftype)
         method = getattr(fm, method_name)
-        resp.body = method()
+        try:
+            resp.body = method()
+        finally:
+            fm.close()
 
         if fm.error_urls:
             # There were errors; report them in the 'X-fm-errors' http header as
@@ -5,7 +5,7 @@ import urllib
 import urllib.request
 
 time_t = Union[Tuple[int, int, int, int, int, int, int, int, int], str]
-stream_str_t = Union[io.FileIO, str]
+stream_str_t = Union[io.FileIO, str, bytes]
 handlers_t = List[urllib.request.BaseHandler]
 headers_t = Dict[str, str]
 
@@ -14,5 +14,6 @@ def parse(url_file_stream_or_string: stream_str_t, etag: Optional[str]=None,
           modified: Optional[time_t]=None, agent: Optional[str]=None, referrer:
           Optional[str]=None, handlers: Optional[handlers_t]=None,
           request_headers: Optional[headers_t]=None, response_headers:
-          Optional[headers_t]=None) -> feedparser.util.FeedParserDict:
+          Optional[headers_t]=None, resolve_relative_uris: Optional[bool]=None,
+          sanitize_html: Optional[bool]=None) -> feedparser.util.FeedParserDict:
     ...
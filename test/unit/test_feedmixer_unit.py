@@ -1,7 +1,11 @@
 import unittest
-from unittest.mock import Mock, MagicMock, call, ANY
+from unittest.mock import Mock, MagicMock, call, ANY, patch
+import json
+import threading
+import time
 import feedparser
-from feedmixer import FeedMixer, ParseError, cache_parser
+import feedmixer
+from feedmixer import FeedMixer, ParseError, cache_parser, cache_entries
 import requests
 from requests.exceptions import RequestException
 from shelfcache import shelfcache
@@ -43,7 +47,8 @@ def build_stub_session():
         """Mimics the cache_get() method"""
         if url == "atom":
             resp = MagicMock()
-            resp.text = TEST_ATOM
+            resp.content = TEST_ATOM.encode()
+            resp.headers = {}
             return resp
         elif url == "fetcherror":
             raise RequestException("fetch error")
@@ -51,11 +56,13 @@ def build_stub_session():
             raise ParseError("parse error")
         elif url == "rss":
             resp = MagicMock()
-            resp.text = TEST_RSS
+            resp.content = TEST_RSS.encode()
+            resp.headers = {}
             return resp
         else:
             resp = MagicMock(spec=requests.Response)
-            resp.text = url
+            resp.content = url.encode()
+            resp.headers = {}
             return resp
     stub_session = MagicMock(spec=requests.session())
     stub_session.get = MagicMock(side_effect=mock_fetch)
@@ -88,25 +95,64 @@ class TestMixedEntries(unittest.TestCase):
         """
         mc = build_stub_session()
         cache_parser.cache_clear()
+        cache_entries.cache_clear()
         fm = FeedMixer(feeds=['atom'], num_keep=2, sess=mc)
         me = fm.mixed_entries
         fm = FeedMixer(feeds=['atom'], num_keep=2, sess=mc)
         me = fm.mixed_entries
+        hits, misses, _, _ = cache_entries.cache_info()
+        self.assertEqual(hits, 1)
+        self.assertEqual(misses, 1)
+
+        # a cache hit skips the parser altogether
+        hits, misses, _, _ = cache_parser.cache_info()
+        self.assertEqual(hits, 0)
+        self.assertEqual(misses, 1)
+
+        # but extracting different metadata from the same document only
+        # re-uses the parsed feed
+        fm = FeedMixer(feeds=['atom'], num_keep=1, sess=mc)
+        me = fm.mixed_entries
         hits, misses, _, _ = cache_parser.cache_info()
         self.assertEqual(hits, 1)
         self.assertEqual(misses, 1)
 
+    def test_memoized_entries_not_shared(self):
+        """
+        Test that modifying one instance's entries doesn't affect another
+        instance which fetched the same feed.
+        """
+        mc = build_stub_session()
+        a = FeedMixer(feeds=['rss'], num_keep=1, sess=mc).mixed_entries
+        title = a[0]['title']
+        a[0]['title'] = 'changed'
+        a[0]['enclosures'].clear()
+        b = FeedMixer(feeds=['rss'], num_keep=1, sess=mc).mixed_entries
+        self.assertIsNot(a[0], b[0])
+        self.assertEqual(b[0]['title'], title)
+        self.assertEqual(len(b[0]['enclosures']), 1)
+
     def test_multi_good(self):
         """
         Test with multiple good URLs.
         """
         cache_parser.cache_clear()
+        cache_entries.cache_clear()
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=['atom', 'rss'], num_keep=2, sess=mc)
+        me = fm.mixed_entries
+        mc.get.assert_has_calls([call('atom'), call('rss')], any_order=True)
+        self.assertEqual(len(me), 4)
+
+    def test_duplicate_feeds(self):
+        """
+        Test that a URL listed more than once is only fetched once.
+        """
         mc = build_stub_session()
         fm = FeedMixer(feeds=['atom', 'rss', 'atom'], num_keep=2, sess=mc)
         me = fm.mixed_entries
-        mc.get.assert_has_calls([call('atom'), call('rss'), call('atom')],
-                any_order=True)
-        self.assertEqual(len(me), 6)
+        self.assertEqual(mc.get.call_count, 2)
+        self.assertEqual(len(me), 4)
 
     def test_single_exception(self):
         """
@@ -145,6 +191,95 @@ class TestMixedEntries(unittest.TestCase):
         self.assertIsInstance(fm.error_urls['fetcherror'], RequestException)
         self.assertIsInstance(fm.error_urls['parseerror'], ParseError)
 
+    def test_sorted(self):
+        """
+        Test that entries from several feeds are mixed in reverse
+        chronological order.
+        """
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=['atom', 'rss'], num_keep=-1, sess=mc)
+        dates = [e['pubdate'] for e in fm.mixed_entries if 'pubdate' in e]
+        self.assertTrue(len(dates) > 12)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_max_per_host(self):
+        """
+        Test that no more than `max_per_host` feeds are fetched concurrently
+        from a single host.
+        """
+        lock = threading.Lock()
+        active = {'a': 0, 'b': 0}
+        peak = {'a': 0, 'b': 0}
+
+        def slow_fetch(url, **kwargs):
+            host = url.split('/')[2]
+            with lock:
+                active[host] += 1
+                peak[host] = max(peak[host], active[host])
+            time.sleep(0.05)
+            with lock:
+                active[host] -= 1
+            resp = MagicMock()
+            resp.content = TEST_ATOM.encode()
+            resp.headers = {}
+            return resp
+
+        mc = build_stub_session()
+        mc.get = MagicMock(side_effect=slow_fetch)
+        feeds = ['http://{}/{}'.format(h, i) for h in 'ab' for i in range(4)]
+        fm = FeedMixer(feeds=feeds, num_keep=1, sess=mc, max_threads=8,
+                       max_per_host=2)
+        me = fm.mixed_entries
+        self.assertEqual(len(me), 8)
+        self.assertLessEqual(max(peak.values()), 2)
+
+    def test_throttle_does_not_block_pool(self):
+        """
+        Test that a throttled host doesn't tie up the threads: while one slow
+        fetch is in progress, all the feeds from another host are fetched even
+        though more feeds from the slow host are waiting.
+        """
+        release = threading.Event()
+        fast_done = threading.Event()
+        lock = threading.Lock()
+        slow_started = []
+        fast_fetched = []
+
+        def fetch(url, **kwargs):
+            if url.startswith('http://slow/'):
+                with lock:
+                    slow_started.append(url)
+                release.wait()
+            else:
+                with lock:
+                    fast_fetched.append(url)
+                    if len(fast_fetched) == 2:
+                        fast_done.set()
+            resp = MagicMock()
+            resp.content = TEST_ATOM.encode()
+            resp.headers = {}
+            return resp
+
+        mc = build_stub_session()
+        mc.get = MagicMock(side_effect=fetch)
+        feeds = (['http://slow/{}'.format(i) for i in range(4)] +
+                 ['http://fast/0', 'http://fast/1'])
+        fm = FeedMixer(feeds=feeds, num_keep=1, sess=mc, max_threads=2,
+                       max_per_host=1)
+
+        bg = threading.Thread(target=lambda: fm.mixed_entries)
+        bg.start()
+        try:
+            self.assertTrue(fast_done.wait(timeout=10))
+            self.assertFalse(release.is_set())
+            with lock:
+                self.assertEqual(slow_started, ['http://slow/0'])
+        finally:
+            release.set()
+            bg.join()
+            fm.close()
+        self.assertEqual(len(fm.mixed_entries), 6)
+
     def test_keep_all_neg(self):
         """
         Setting num_keep to -1 should keep all the entries.
@@ -186,6 +321,38 @@ class TestMixedEntries(unittest.TestCase):
         mc.get.assert_called_once_with('atom')
         self.assertIn('author_name', me[0])
 
+    def test_sanitize(self):
+        """
+        Test that entry HTML is sanitized unless `sanitize` is False.
+        """
+        doc = ('<rss version="2.0"><channel><title>T</title><link>l</link>'
+               '<item><title>i</title><description>&lt;script&gt;x&lt;/script'
+               '&gt;&lt;p&gt;y&lt;/p&gt;</description></item></channel></rss>')
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=[doc], sess=mc)
+        self.assertNotIn('<script>', fm.mixed_entries[0]['description'])
+        fm = FeedMixer(feeds=[doc], sess=mc, sanitize=False)
+        self.assertIn('<script>', fm.mixed_entries[0]['description'])
+
+    def test_header_charset(self):
+        """
+        Test that a charset given only in the Content-Type header is used to
+        decode the feed.
+        """
+        doc = ('<rss version="2.0"><channel><title>T</title><link>l</link>'
+               '<item><title>日本語</title></item></channel></rss>')
+
+        def fetch(url, **kwargs):
+            resp = MagicMock()
+            resp.content = doc.encode('shift_jis')
+            resp.headers = {'content-type': 'text/xml; charset=shift_jis'}
+            return resp
+
+        mc = build_stub_session()
+        mc.get = MagicMock(side_effect=fetch)
+        fm = FeedMixer(feeds=['sjis'], sess=mc)
+        self.assertEqual(fm.mixed_entries[0]['title'], '日本語')
+
 
 class TestFeed(unittest.TestCase):
     def test_set_feed(self):
@@ -214,6 +381,83 @@ class TestFeed(unittest.TestCase):
         fm.num_keep = 1
         self.assertEqual(len(fm.mixed_entries), 2)
 
+    def test_shrink_num_keep(self):
+        """
+        Test that decreasing num_keep re-uses the entries already fetched,
+        while increasing it re-fetches the feeds.
+        """
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=['atom', 'rss'], num_keep=3, sess=mc)
+        self.assertEqual(len(fm.mixed_entries), 6)
+        self.assertEqual(mc.get.call_count, 2)
+
+        fm.num_keep = 1
+        self.assertEqual(len(fm.mixed_entries), 2)
+        self.assertEqual(mc.get.call_count, 2)
+
+        fm.num_keep = 2
+        self.assertEqual(len(fm.mixed_entries), 4)
+        self.assertEqual(mc.get.call_count, 4)
+
+    def test_shrink_num_keep_unordered(self):
+        """
+        Test that decreasing num_keep keeps the same entries as fetching with
+        the smaller num_keep in the first place, even for a feed whose entries
+        aren't in chronological order.
+        """
+        doc = ('<rss version="2.0"><channel><title>T</title><link>l</link>'
+               '<item><title>old</title>'
+               '<pubDate>Mon, 01 Jan 2018 00:00:00 +0000</pubDate></item>'
+               '<item><title>new</title>'
+               '<pubDate>Mon, 01 Jan 2024 00:00:00 +0000</pubDate></item>'
+               '</channel></rss>')
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=[doc], num_keep=2, sess=mc)
+        titles = [e['title'] for e in fm.mixed_entries]
+        self.assertEqual(titles, ['new', 'old'])
+
+        fm.num_keep = 1
+        shrunk = [e['title'] for e in fm.mixed_entries]
+        fresh = FeedMixer(feeds=[doc], num_keep=1, sess=mc)
+        self.assertEqual(shrunk, [e['title'] for e in fresh.mixed_entries])
+        self.assertEqual(shrunk, ['old'])
+
+    def test_default_feeds_not_shared(self):
+        """
+        Test that instances created without `feeds` don't share a list.
+        """
+        fm = FeedMixer()
+        fm.feeds.append('atom')
+        self.assertEqual(FeedMixer().feeds, [])
+
+    def test_max_feeds(self):
+        """
+        Test that `feeds` is truncated to `max_feeds`.
+        """
+        fm = FeedMixer(feeds=['atom', 'rss', 'atom'], max_feeds=2)
+        self.assertEqual(fm.feeds, ['atom', 'rss'])
+        fm.feeds = ['rss', 'atom', 'rss']
+        self.assertEqual(fm.feeds, ['rss', 'atom'])
+
+    def test_close(self):
+        """
+        Test that the fetching threads are re-used until `close()` is called,
+        after which the feeds can still be fetched again.
+        """
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=['atom', 'rss'], num_keep=1, sess=mc)
+        self.assertEqual(len(fm.mixed_entries), 2)
+        executor = fm._executor
+        fm.feeds = ['atom']
+        self.assertEqual(len(fm.mixed_entries), 1)
+        self.assertIs(fm._executor, executor)
+
+        fm.close()
+        self.assertIsNone(fm._executor)
+        fm.feeds = ['rss']
+        self.assertEqual(len(fm.mixed_entries), 1)
+        fm.close()
+
 
 class TestAtomFeed(unittest.TestCase):
     def test_atom_feed(self):
@@ -278,3 +522,16 @@ class TestJSONFeed(unittest.TestCase):
         jf = fm.json_feed()
         self.maxDiff = None
         self.assertIn(expected, jf)
+
+    @unittest.skipIf(feedmixer.orjson is None, "orjson is not installed")
+    def test_json_feed_orjson(self):
+        """
+        Test that serializing with orjson produces the same JSON document as
+        the standard library.
+        """
+        mc = build_stub_session()
+        fm = FeedMixer(feeds=['atom', 'rss'], num_keep=-1, sess=mc)
+        fast = fm.json_feed()
+        with patch('feedmixer.orjson', None):
+            slow = fm.json_feed()
+        self.assertEqual(json.loads(fast), json.loads(slow))